@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
-import os, math, shutil, tempfile, uuid, subprocess, pathlib, threading, time, traceback, sys, json
+import os, shutil, tempfile, uuid, subprocess, pathlib, threading, time, traceback, sys, json, contextlib, hashlib, selectors, datetime, types
 from collections import deque
-from flask import Flask, request, send_file, render_template_string, redirect, url_for, jsonify, send_from_directory, make_response, session
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, send_file, redirect, url_for, jsonify, send_from_directory, make_response, session
+from werkzeug.utils import secure_filename
 
 # YouTube API imports (optional - only loaded if credentials exist)
 YOUTUBE_ENABLED = False
@@ -14,9 +16,46 @@ try:
 except ImportError:
     pass
 
+# io_uring batched upload writes (optional - Linux with the liburing package). Releases
+# after 2024.5.3 renamed io_uring/io_uring_cqe to Ring/Cqe; accept either spelling.
+try:
+    import liburing
+    URING_RING = getattr(liburing, 'Ring', None) or liburing.io_uring
+    URING_CQE = getattr(liburing, 'Cqe', None) or liburing.io_uring_cqe
+except (ImportError, AttributeError):
+    liburing = None
+
+# Header-based duration lookup (optional - falls back to ffprobe)
+try:
+    import mutagen
+except ImportError:
+    mutagen = None
+
+# Faster JSON encoding for the polling endpoints (optional - falls back to the stdlib)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 app = Flask(__name__)
+
+if orjson is not None:
+    from flask.json.provider import DefaultJSONProvider
+
+    class OrjsonProvider(DefaultJSONProvider):
+        """jsonify() through orjson; same key order and indenting as Flask's default"""
+        def dumps(self, obj, **kwargs):
+            option = orjson.OPT_NON_STR_KEYS
+            if kwargs.get('sort_keys', self.sort_keys): option |= orjson.OPT_SORT_KEYS
+            if kwargs.get('indent'): option |= orjson.OPT_INDENT_2
+            return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    app.json = OrjsonProvider(app)
 app.secret_key = "lofi-" + str(uuid.uuid4())
 app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024 * 1024  # 2GB uploads
+# Let a front server send downloads: X-Sendfile (Apache/lighttpd) or nginx X-Accel-Redirect
+app.config['USE_X_SENDFILE'] = os.environ.get('LOFI_X_SENDFILE') == '1'
+X_ACCEL_PREFIX = os.environ.get('LOFI_X_ACCEL_PREFIX')  # internal nginx location aliased to the temp dir
 
 # --- simple error handler so 500s show in the terminal nicely ---
 @app.errorhandler(Exception)
@@ -26,42 +65,273 @@ def on_error(e):
     return ("Internal Server Error. Check terminal for traceback.", 500, {"Content-Type": "text/plain"})
 
 JOBS = {}
-QUEUE = deque()
-RUNNING = None
+QUEUE = deque()  # job ids submitted but not yet picked up by a worker
+QUEUE_POS = {}  # job id -> 1-based queue position, rebuilt whenever QUEUE changes
+QUEUE_LOCK = threading.Lock()
+RUNNING = set()
+# Bumped on every job or queue change; pollers send it back as an ETag and can long-poll on JOBS_CHANGED
+JOBS_VERSION = 0
+BOOT_ID = uuid.uuid4().hex[:8]  # JOBS_VERSION restarts at 0, so tags from an earlier process must not match
+JOBS_CHANGED = threading.Condition()
+# Each ffmpeg already uses many threads, so only a few jobs run side by side
+MAX_JOBS = int(os.environ.get('LOFI_CONCURRENCY') or max(1, (os.cpu_count() or 4)//4))
+EXEC = ThreadPoolExecutor(max_workers=MAX_JOBS)
+# Consumer GPUs only allow a few concurrent hardware encode sessions
+ENCODER_SEM = threading.BoundedSemaphore(int(os.environ.get('LOFI_HW_SESSIONS', 1)))
+# Caps on concurrent ffmpeg processes so they don't oversubscribe the CPU. Streams run for
+# hours, so they get their own slots and can never starve renders (or the other way round).
+MAX_FFMPEG = int(os.environ.get('LOFI_MAX_FFMPEG') or max(1, (os.cpu_count() or 2)//2))
+MAX_STREAMS = int(os.environ.get('LOFI_MAX_STREAMS', 2))
+FFMPEG_SEMS = {'render': threading.BoundedSemaphore(MAX_FFMPEG), 'stream': threading.BoundedSemaphore(MAX_STREAMS)}
+FFMPEG_ACTIVE = {'render': 0, 'stream': 0}
+_FFMPEG_LOCK = threading.Lock()
+
+def acquire_ffmpeg(kind='render', blocking=True, timeout=None):
+    sem = FFMPEG_SEMS[kind]
+    if not (sem.acquire(timeout=timeout) if blocking else sem.acquire(False)):
+        return False
+    with _FFMPEG_LOCK: FFMPEG_ACTIVE[kind] += 1
+    return True
+
+def release_ffmpeg(kind='render'):
+    with _FFMPEG_LOCK: FFMPEG_ACTIVE[kind] -= 1
+    FFMPEG_SEMS[kind].release()
+
+def acquire_for_job(j, acquire, release):
+    """Call acquire(timeout) until it succeeds, giving up if `j` is canceled meanwhile"""
+    while not acquire(0.5):
+        if j.canceled: return False
+    if j.canceled:
+        release(); return False
+    return True
 STREAMS = {}  # Active YouTube streams: {job_id: {broadcast_id, stream_proc, status, ...}}
 VIDEOS = {}  # Available videos for streaming: {video_id: {path, name, size, type, created_at}}
 
+# JOBS, STREAMS and VIDEOS are copy-on-write: adding or removing an entry swaps in a new
+# dict, so readers can iterate the one they picked up without a lock. Entries themselves
+# are updated in place.
+_REGISTRY_LOCK = threading.Lock()
+
+def registry_put(name, key, value):
+    with _REGISTRY_LOCK:
+        globals()[name] = {**globals()[name], key: value}
+
+def registry_pop(name, key):
+    with _REGISTRY_LOCK:
+        reg = globals()[name]
+        if key in reg:
+            globals()[name] = {k: v for k, v in reg.items() if k != key}
+
 TMP_PREFIX = "lofi_"
 TMP_BASE = pathlib.Path(tempfile.gettempdir())
 
 def cleanup_old_tmp(days=2):
     cutoff = time.time() - days*86400
-    for p in TMP_BASE.glob(f"{TMP_PREFIX}*"):
+    try:
+        with os.scandir(TMP_BASE) as it:
+            for e in it:
+                try:
+                    if e.name.startswith(TMP_PREFIX) and e.is_dir(follow_symlinks=False) and e.stat(follow_symlinks=False).st_mtime < cutoff:
+                        shutil.rmtree(e.path, ignore_errors=True)
+                except Exception:
+                    pass
+    except OSError:
+        pass
+cleanup_old_tmp()
+
+# ===== Video encoder selection =====
+HW_ENCODERS = ['h264_nvenc', 'h264_qsv', 'h264_vaapi', 'h264_videotoolbox']
+VAAPI_DEVICE = os.environ.get('LOFI_VAAPI_DEVICE', '/dev/dri/renderD128')
+
+def detect_hw_encoder():
+    """Return the first hardware H.264 encoder that actually works here, else libx264"""
+    forced = os.environ.get('LOFI_ENCODER')
+    if forced:
+        return forced
+    try:
+        out = subprocess.run(['ffmpeg','-hide_banner','-encoders'], capture_output=True, text=True, timeout=10).stdout
+    except Exception:
+        return 'libx264'
+    for enc in HW_ENCODERS:
+        if enc not in out:
+            continue
+        # Being compiled in doesn't mean the device is present, so try a tiny encode
+        pre, vcodec, vf_tail = encoder_args(enc, 'ultrafast')
+        test = ['ffmpeg','-hide_banner','-loglevel','error'] + pre + [
+            '-f','lavfi','-i','color=s=256x256:d=0.2',
+            '-vf', f'null{vf_tail}'] + vcodec + ['-f','null','-']
         try:
-            if p.is_dir() and p.stat().st_mtime < cutoff:
-                shutil.rmtree(p, ignore_errors=True)
+            if subprocess.run(test, capture_output=True, timeout=15).returncode == 0:
+                return enc
         except Exception:
             pass
-cleanup_old_tmp()
+    return 'libx264'
+
+def encoder_args(encoder, preset):
+    """Return (global args, codec args, video filter suffix) for an H.264 encoder"""
+    if encoder == 'h264_nvenc':
+        return [], ['-c:v','h264_nvenc','-preset','p4','-tune','hq','-rc','vbr','-cq','23','-b:v','0','-pix_fmt','yuv420p'], ''
+    if encoder == 'h264_qsv':
+        return [], ['-c:v','h264_qsv','-preset','veryfast','-global_quality','23'], ',format=nv12'
+    if encoder == 'h264_vaapi':
+        return ['-vaapi_device', VAAPI_DEVICE], ['-c:v','h264_vaapi','-qp','23'], ',format=nv12,hwupload'
+    if encoder == 'h264_videotoolbox':
+        return [], ['-c:v','h264_videotoolbox','-b:v','6M','-pix_fmt','yuv420p'], ''
+    return [], ['-c:v','libx264','-preset',preset,'-pix_fmt','yuv420p'], ''
+
+# Still backgrounds are encoded once as a clip of this length, then stream-copied
+STILL_FPS = 25
+STILL_CLIP_SEC = 10
+STILL_PRESET = 'medium'  # only a few hundred frames, so spend the time on real skip frames
+
+# Largest looped mix (as s16 PCM) rendered in a single ffmpeg pass; longer ones use playlist.mp3
+FUSE_MAX_BYTES = int(os.environ.get('LOFI_FUSE_MAX_MB', 512)) * 1024 * 1024
+
+# Deeper per-input packet queues so one input (e.g. a looped image) can't stall the others
+INPUT_QUEUE = ['-thread_queue_size','512']
+
+# Mixes longer than this are written as fragmented MP4 so there is no moov rewrite pass at the end
+FRAG_MIN_MINUTES = 240
+
+HW_ENCODER = detect_hw_encoder()
+print(f"Video encoder: {HW_ENCODER}", file=sys.stderr)
+
+# YouTube RTMP video rate control (VBR: average bitrate with a 1.4x peak)
+STREAM_BITRATE = os.environ.get('LOFI_STREAM_BITRATE', '2500k')
+STREAM_MAXRATE = os.environ.get('LOFI_STREAM_MAXRATE', '3500k')
+STREAM_BUFSIZE = os.environ.get('LOFI_STREAM_BUFSIZE', '5000k')
 
 # ===== YouTube Live Streaming Functions =====
+TOKEN_STALE_SEC = 300  # refresh in the background once a token has less than this left
+# Single on-disk copy of the OAuth credentials, readable by stream workers outside a request
+YT_CREDS_PATH = pathlib.Path(os.environ.get('LOFI_YT_CREDS', '.yt_creds.json'))
+
+class TokenCache:
+    """A built Credentials object whose token is refreshed off the request path"""
+    def __init__(self, creds):
+        self.creds = creds
+        # Only guards `refreshing`; the network refresh itself runs without it
+        self.lock = threading.Condition()
+        self.refreshing = False
+
+    def remaining(self):
+        # credentials saved without an expiry have none
+        if self.creds.expiry is None:
+            return None
+        return (self.creds.expiry - datetime.datetime.utcnow()).total_seconds()
+
+    def claim(self):
+        """True if the caller gets to run the refresh, False if one is already under way"""
+        with self.lock:
+            if self.refreshing: return False
+            self.refreshing = True
+            return True
+
+    def refresh(self):
+        """Run a refresh claimed with claim()"""
+        try:
+            self.creds.refresh(Request())  # updates the token in place
+            # Don't write the file back if the account was disconnected meanwhile
+            if current_youtube_token() is self:
+                save_youtube_credentials(self.creds)
+        except Exception as e:
+            print(f"YouTube token refresh failed: {e}", file=sys.stderr)
+        finally:
+            with self.lock:
+                self.refreshing = False
+                self.lock.notify_all()
+
+    def refresh_async(self):
+        if self.claim():
+            threading.Thread(target=self.refresh, daemon=True).start()
+
+    def get(self):
+        """Fresh or stale: return at once (stale schedules a refresh); expired: refresh inline"""
+        if not self.creds.refresh_token:
+            return self.creds
+        left = self.remaining()
+        if left is not None and left <= 0:
+            if self.claim():
+                self.refresh()
+            else:
+                # Someone else is already refreshing the expired token: wait for theirs
+                with self.lock:
+                    self.lock.wait_for(lambda: not self.refreshing, timeout=30)
+        elif left is None or left < TOKEN_STALE_SEC:
+            self.refresh_async()
+        return self.creds
+
+_YT_TOKEN = None  # TokenCache, loaded from YT_CREDS_PATH on first use
+_YT_TOKEN_LOCK = threading.Lock()
+
+def token_refresher():
+    """Refresh the cached token before it expires, even when no request comes in"""
+    while True:
+        time.sleep(60)
+        cache = current_youtube_token()
+        if cache is None: continue
+        left = cache.remaining()
+        if cache.creds.refresh_token and left is not None and left < TOKEN_STALE_SEC:
+            cache.refresh_async()
+
+if YOUTUBE_ENABLED:
+    threading.Thread(target=token_refresher, daemon=True).start()
+
+def creds_to_dict(creds):
+    return {
+        'token': creds.token,
+        'refresh_token': creds.refresh_token,
+        'token_uri': creds.token_uri,
+        'client_id': creds.client_id,
+        'client_secret': creds.client_secret,
+        'scopes': creds.scopes,
+        'expiry': creds.expiry.isoformat() if creds.expiry else None
+    }
+
+def save_youtube_credentials(creds):
+    """Write the credentials to YT_CREDS_PATH (owner-only) and make them the cached token"""
+    global _YT_TOKEN
+    tmp = YT_CREDS_PATH.with_name(YT_CREDS_PATH.name + '.tmp')
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(creds_to_dict(creds), f)
+    os.replace(tmp, YT_CREDS_PATH)
+    with _YT_TOKEN_LOCK:
+        if _YT_TOKEN is None or _YT_TOKEN.creds is not creds:
+            _YT_TOKEN = TokenCache(creds)
+
+def current_youtube_token():
+    """The cached TokenCache, dropped once YT_CREDS_PATH has been deleted"""
+    global _YT_TOKEN
+    with _YT_TOKEN_LOCK:
+        if _YT_TOKEN is not None and not YT_CREDS_PATH.exists():
+            _YT_TOKEN = None
+        return _YT_TOKEN
+
+def clear_youtube_credentials():
+    global _YT_TOKEN
+    with _YT_TOKEN_LOCK:
+        _YT_TOKEN = None
+        with contextlib.suppress(FileNotFoundError): YT_CREDS_PATH.unlink()
+
 def get_youtube_credentials():
-    """Get YouTube API credentials from session or None"""
-    if not YOUTUBE_ENABLED or 'youtube_credentials' not in session:
+    """Get YouTube API credentials (read once from YT_CREDS_PATH) or None"""
+    global _YT_TOKEN
+    if not YOUTUBE_ENABLED:
         return None
-    creds_data = session['youtube_credentials']
-    creds = Credentials(**creds_data)
-    if creds.expired and creds.refresh_token:
-        creds.refresh(Request())
-        session['youtube_credentials'] = {
-            'token': creds.token,
-            'refresh_token': creds.refresh_token,
-            'token_uri': creds.token_uri,
-            'client_id': creds.client_id,
-            'client_secret': creds.client_secret,
-            'scopes': creds.scopes
-        }
-    return creds
+    current_youtube_token()
+    with _YT_TOKEN_LOCK:
+        if _YT_TOKEN is None:
+            try:
+                data = json.loads(YT_CREDS_PATH.read_text())
+            except (OSError, ValueError):
+                return None
+            expiry = data.pop('expiry', None)
+            creds = Credentials(**data)
+            if expiry: creds.expiry = datetime.datetime.fromisoformat(expiry)
+            _YT_TOKEN = TokenCache(creds)
+        cache = _YT_TOKEN
+    return cache.get()
 
 def create_youtube_broadcast(creds, title, description, privacy='unlisted'):
     """Create a YouTube live broadcast and return stream key and URL"""
@@ -143,11 +413,15 @@ def start_youtube_stream(video_path, rtmp_url, stream_key, job_id):
         '-i', str(video_path),
         '-c:v', 'libx264',
         '-preset', 'veryfast',
-        '-b:v', '3000k',
-        '-maxrate', '3000k',
-        '-bufsize', '6000k',
+        '-tune', 'zerolatency',
+        '-profile:v', 'high',
+        '-level:v', '4.2',
+        '-b:v', STREAM_BITRATE,
+        '-maxrate', STREAM_MAXRATE,
+        '-bufsize', STREAM_BUFSIZE,
         '-pix_fmt', 'yuv420p',
-        '-g', '60',  # Keyframe every 2 seconds at 30fps
+        '-x264-params', 'keyint=60:min-keyint=60:scenecut=0',  # Fixed keyframe every 2 seconds at 30fps
+        '-flags', '+global_header',
         '-c:a', 'aac',
         '-b:a', '192k',
         '-ar', '44100',
@@ -155,33 +429,117 @@ def start_youtube_stream(video_path, rtmp_url, stream_key, job_id):
         full_rtmp
     ]
 
+    # Streams run indefinitely, so don't wait for a slot
+    if not acquire_ffmpeg('stream', blocking=False):
+        print(f"Stream start error: all {MAX_STREAMS} stream slots are busy", file=sys.stderr)
+        return False
+    proc = None
     try:
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-        STREAMS[job_id]['stream_proc'] = proc
-        STREAMS[job_id]['status'] = 'streaming'
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        info = STREAMS[job_id]
+        info['stream_proc'] = proc
+        info['status'] = 'streaming'
 
         # Monitor stream in background
-        def monitor():
-            for line in proc.stdout:
-                if job_id in STREAMS:
-                    STREAMS[job_id]['last_output'] = line.strip()
-            proc.wait()
-            if job_id in STREAMS:
-                STREAMS[job_id]['status'] = 'stopped'
-                STREAMS[job_id].pop('stream_proc', None)
-
-        threading.Thread(target=monitor, daemon=True).start()
+        watch_stream(job_id, proc)
         return True
     except Exception as e:
+        if proc is not None: proc.kill()  # nothing would ever reap it
+        release_ffmpeg('stream')
         print(f"Stream start error: {e}", file=sys.stderr)
         return False
 
+# One thread watches the output of every running stream ffmpeg
+_STREAM_SELECTOR = selectors.DefaultSelector()
+_STREAM_MONITOR = None
+_STREAM_MONITOR_LOCK = threading.Lock()
+_STREAMS_ADDED = threading.Event()  # lets the monitor sleep while no stream is running
+
+def ensure_stream_monitor():
+    global _STREAM_MONITOR
+    with _STREAM_MONITOR_LOCK:
+        if _STREAM_MONITOR is None:
+            _STREAM_MONITOR = threading.Thread(target=monitor_streams, daemon=True)
+            _STREAM_MONITOR.start()
+
+def watch_stream(job_id, proc):
+    state = [job_id, proc, b'']
+    if os.name == 'nt':
+        # select() only works on sockets on Windows, so each stream gets its own reader there
+        threading.Thread(target=read_stream, args=(state,), daemon=True).start()
+        return
+    ensure_stream_monitor()
+    _STREAM_SELECTOR.register(proc.stdout, selectors.EVENT_READ, data=state)
+    _STREAMS_ADDED.set()
+
+def stream_output(state, chunk):
+    job_id, _, pending = state
+    # ffmpeg ends its stats line with \r, so treat both as line breaks
+    *lines, state[2] = (pending + chunk).replace(b'\r', b'\n').split(b'\n')
+    lines = [l for l in lines if l.strip()]
+    info = STREAMS.get(job_id)
+    if lines and info is not None:
+        info['last_output'] = lines[-1].decode('utf-8', 'replace').strip()
+
+def stream_ended(job_id, proc):
+    try:
+        proc.wait()
+    finally:
+        release_ffmpeg('stream')
+    info = STREAMS.get(job_id)
+    if info is not None and info.get('stream_proc') in (proc, None):
+        info['status'] = 'stopped'
+        info.pop('stream_proc', None)
+
+def read_stream(state):
+    job_id, proc, _ = state
+    try:
+        for chunk in iter(lambda: proc.stdout.read1(65536), b''):
+            stream_output(state, chunk)
+    except Exception:
+        traceback.print_exc()
+    finally:
+        proc.stdout.close()
+        stream_ended(job_id, proc)
+
+def monitor_streams():
+    # Errors are logged and skipped: if this thread died, no stream slot would ever be released
+    while True:
+        try:
+            if not _STREAM_SELECTOR.get_map():
+                _STREAMS_ADDED.wait()
+                _STREAMS_ADDED.clear()
+                continue
+            events = _STREAM_SELECTOR.select(1.0)
+        except Exception:
+            traceback.print_exc()
+            for key in list(_STREAM_SELECTOR.get_map().values()):
+                if key.fileobj.closed:
+                    with contextlib.suppress(KeyError, ValueError): _STREAM_SELECTOR.unregister(key.fileobj)
+                    stream_ended(key.data[0], key.data[1])
+            time.sleep(1)
+            continue
+        for key, _ in events:
+            try:
+                try:
+                    chunk = os.read(key.fd, 65536)
+                except OSError:
+                    chunk = b''
+                if chunk:
+                    stream_output(key.data, chunk)
+                    continue
+                with contextlib.suppress(KeyError, ValueError): _STREAM_SELECTOR.unregister(key.fileobj)
+                key.fileobj.close()
+                stream_ended(key.data[0], key.data[1])
+            except Exception:
+                traceback.print_exc()
+
 def stop_youtube_stream(job_id):
     """Stop an active YouTube stream"""
-    if job_id not in STREAMS:
+    stream_info = STREAMS.get(job_id)
+    if stream_info is None:
         return False
 
-    stream_info = STREAMS[job_id]
     proc = stream_info.get('stream_proc')
 
     if proc:
@@ -462,7 +820,7 @@ input[type="text"],input[type="number"],select,input[type="file"]{width:100%;bor
 
   <div class="card">
     <div>
-      <div style="display:flex;align-items:center;justify-content:space-between"><h3>Jobs</h3><span class="small">Single-concurrency encoder</span></div>
+      <div style="display:flex;align-items:center;justify-content:space-between"><h3>Jobs</h3><span class="small">Queued encoder</span></div>
       <table class="table">
         <thead><tr><th>Job</th><th>Status</th><th>Queue</th><th>Progress</th><th>Output</th><th>Action</th></tr></thead>
         <tbody id="jobsBody"></tbody>
@@ -474,31 +832,363 @@ input[type="text"],input[type="number"],select,input[type="file"]{width:100%;bor
 <script src="/static/app.js"></script>
 </body>
 </html>'''
+# Parsed once here; the rendered page is cached per script root (the only thing url_for depends on)
+HTML_TEMPLATE = app.jinja_env.from_string(HTML)
+_INDEX_PAGES = {}
 
-def push_log(job_id, line):
-    j = JOBS[job_id]
-    j.setdefault('log', []).append(line)
-    if len(j['log']) > 2000:
-        j['log'] = j['log'][-1000:]
+def get_dur(path):
+    """Duration of a media file in seconds, read from its headers when possible"""
+    if mutagen is not None:
+        try:
+            f = mutagen.File(str(path))
+            if f is not None and f.info.length > 0:
+                return float(f.info.length)
+        except Exception:
+            pass
+    out = subprocess.run(['ffprobe','-v','error','-show_entries','format=duration','-of','default=nw=1:nk=1', str(path)], capture_output=True, text=True)
+    try: return float(out.stdout.strip())
+    except ValueError: return 0.0
+
+def is_copyable_mp3(path):
+    """True if `path` is a 44.1 kHz stereo MP3 that can be concatenated without re-encoding"""
+    if mutagen is None or pathlib.Path(path).suffix.lower() != '.mp3':
+        return False
+    try:
+        f = mutagen.File(str(path))
+        return f is not None and type(f).__name__ == 'MP3' and f.info.sample_rate == 44100 and f.info.channels == 2
+    except Exception:
+        return False
+
+UPLOAD_CHUNK = 1 << 20
 
-def run_and_stream(cmd, job_id):
+# Finished renders and crossfaded playlists, keyed by a hash of their inputs and settings
+RENDER_CACHE = pathlib.Path(os.environ.get('LOFI_CACHE_DIR') or TMP_BASE/'lofimix_cache')
+# Least recently used entries are pruned past this size; 0 turns the cache off
+CACHE_MAX_BYTES = int(float(os.environ.get('LOFI_CACHE_MAX_GB', 20)) * (1 << 30))
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class HashingReader:
+    """Wrap an upload stream so whatever is read from it is also hashed"""
+    def __init__(self, stream):
+        self.stream = stream
+        self.hash = hashlib.sha1()
+
+    def read(self, n=-1):
+        buf = self.stream.read(n)
+        self.hash.update(buf)
+        return buf
+
+    def seek(self, pos, whence=0):
+        self.hash = hashlib.sha1()  # only ever rewound to the start for a retry
+        return self.stream.seek(pos, whence)
+
+def cache_key(*parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+def cache_fetch(key, suffix, dest):
+    """Hard-link (or copy) a cached file to `dest`; False on a miss"""
+    src = RENDER_CACHE/f'{key}{suffix}'
+    if not CACHE_MAX_BYTES or not src.exists():
+        return False
+    try:
+        with contextlib.suppress(FileNotFoundError): os.unlink(dest)
+        link_or_copy(src, dest)
+        os.utime(src)  # mtime doubles as last use for prune_cache
+        return True
+    except OSError:
+        return False
+
+def cache_store(src, key, suffix):
+    if not CACHE_MAX_BYTES:
+        return
+    try:
+        RENDER_CACHE.mkdir(parents=True, exist_ok=True)
+        tmp = RENDER_CACHE/f'.{key}{suffix}.{uuid.uuid4().hex}'
+        link_or_copy(src, tmp)
+        os.utime(tmp)
+        os.replace(tmp, RENDER_CACHE/f'{key}{suffix}')
+    except OSError as e:
+        print(f"Render cache store failed: {e}", file=sys.stderr)
+    prune_cache()
+
+_CACHE_PRUNE_LOCK = threading.Lock()
+
+def prune_cache(max_bytes=None):
+    """Delete least recently used cache entries until the cache fits in `max_bytes`"""
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    now = time.time()
+    with _CACHE_PRUNE_LOCK:
+        entries = []
+        with contextlib.suppress(FileNotFoundError), os.scandir(RENDER_CACHE) as it:
+            for e in it:
+                try: st = e.stat()
+                except FileNotFoundError: continue
+                if e.name.startswith('.'):
+                    # Temp link left behind by a crashed cache_store
+                    if now - st.st_mtime > 3600:
+                        with contextlib.suppress(OSError): os.unlink(e.path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, e.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes: break
+            with contextlib.suppress(OSError):
+                os.unlink(path); total -= size
+
+def save_upload(f, path):
+    """Write an uploaded file to `path` with 1 MiB copies (sendfile if Werkzeug spilled it to disk)"""
+    src = f.stream
+    with open(path, 'wb') as dst:
+        # fileno() on an in-memory SpooledTemporaryFile would first roll it over to disk
+        fd = None
+        if getattr(src, '_rolled', True):
+            try:
+                fd = src.fileno()
+            except (AttributeError, OSError):
+                pass
+        if fd is not None and hasattr(os, 'sendfile'):
+            try:
+                offset, end = src.tell(), os.fstat(fd).st_size
+                while offset < end:
+                    sent = os.sendfile(dst.fileno(), fd, offset, end - offset)
+                    if not sent: break
+                    offset += sent
+                return
+            except OSError:
+                dst.seek(0); dst.truncate()
+        shutil.copyfileobj(src, dst, length=UPLOAD_CHUNK)
+
+class UringBatchWriter:
+    """Write several uploads at once through io_uring, keeping up to `depth` 1 MiB writes in flight"""
+    def __init__(self, depth=16):
+        self.depth = depth
+        self.ring = URING_RING()
+        self.cqe = URING_CQE()
+        liburing.io_uring_queue_init(64, self.ring, 0)
+
+    def close(self):
+        liburing.io_uring_queue_exit(self.ring)
+
+    def _reap(self, inflight):
+        liburing.io_uring_wait_cqe(self.ring, self.cqe)
+        cqe = self.cqe
+        res, buf = cqe.res, inflight.pop(cqe.user_data)
+        liburing.io_uring_cqe_seen(self.ring, cqe)
+        return res, buf
+
+    def write_all(self, uploads):
+        fds, pending, inflight, tag = [], [], {}, 0
+        try:
+            for f, path in uploads:
+                fds.append(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644))
+                pending.append([f.stream, fds[-1], 0])
+            while pending or inflight:
+                # Fill the ring round-robin across files so the disk sees them concurrently
+                while pending and len(inflight) < self.depth:
+                    for item in list(pending):
+                        if len(inflight) >= self.depth: break
+                        stream, fd, offset = item
+                        buf = stream.read(UPLOAD_CHUNK)
+                        if not buf:
+                            pending.remove(item); continue
+                        sqe = liburing.io_uring_get_sqe(self.ring)
+                        liburing.io_uring_prep_write(sqe, fd, buf, len(buf), offset)
+                        liburing.io_uring_sqe_set_data64(sqe, tag)
+                        inflight[tag] = buf  # the kernel reads it asynchronously, keep it alive
+                        item[2] = offset + len(buf); tag += 1
+                liburing.io_uring_submit(self.ring)
+                if inflight:
+                    res, buf = self._reap(inflight)
+                    if res != len(buf):
+                        raise OSError(-res if res < 0 else 0, 'io_uring write failed')
+        finally:
+            # Never close an fd the kernel may still be writing to
+            try:
+                while inflight: self._reap(inflight)
+            finally:
+                for fd in fds: os.close(fd)
+
+def save_uploads(uploads, hash_paths=()):
+    """Save (FileStorage, path) pairs, batched through io_uring when available.
+    Returns {path: sha1} for the uploads in `hash_paths`, hashed as they are written."""
+    hashers = {}
+    for f, path in uploads:
+        if str(path) in hash_paths:
+            f.stream = hashers[str(path)] = HashingReader(f.stream)
+    try:
+        _save_uploads(uploads)
+    finally:
+        for f, _ in uploads:
+            if isinstance(f.stream, HashingReader): f.stream = f.stream.stream
+    return {p: h.hash.hexdigest() for p, h in hashers.items()}
+
+_URING_BROKEN = False  # set after the first failure so later enqueues skip straight to the fallback
+
+def _save_uploads(uploads):
+    global _URING_BROKEN
+    if liburing is not None and not _URING_BROKEN and len(uploads) > 1:
+        try:
+            w = UringBatchWriter()
+            try:
+                w.write_all(uploads); return
+            finally:
+                w.close()
+        except Exception as e:
+            _URING_BROKEN = True
+            print(f"io_uring upload failed, using plain writes from now on: {e}", file=sys.stderr)
+            for f, _ in uploads: f.stream.seek(0)
+    for f, path in uploads:
+        save_upload(f, path)
+
+LOG_MAX_LINES = 500  # per job in memory; older ffmpeg output is spilled to ffmpeg.log in the job dir
+
+class Job:
+    """State of one render; __slots__ keeps the many small per-job fields compact"""
+    __slots__ = ('id', 'cfg', 'stage', 'progress', 'progress_kv', 'pct', 'log', 'log_total', 'done', 'error',
+                 'outfile', 'target', 'step_target', 'canceled', 'version', 'proc', 'completed_at')
+
+    def __init__(self, id, cfg):
+        self.id = id
+        self.cfg = cfg
+        self.stage = 'Queued...'
+        self.progress = ''
+        self.progress_kv = {}
+        self.pct = None
+        self.log = deque(maxlen=LOG_MAX_LINES)
+        self.log_total = 0  # lines ever logged, for ?since= deltas
+        self.done = False
+        self.error = None
+        self.outfile = None
+        self.target = None
+        self.step_target = None  # seconds of output the running ffmpeg step writes; pct is against this
+        self.canceled = False
+        self.version = 0
+        self.proc = None
+        self.completed_at = None  # set once the worker is finished with the job
+
+def touch_jobs(j=None):
+    """Record a change to job `j` (or just the queue) and wake long-polling requests"""
+    global JOBS_VERSION
+    with JOBS_CHANGED:
+        if j is not None: j.version += 1
+        JOBS_VERSION += 1
+        JOBS_CHANGED.notify_all()
+
+def job_update(j, **kw):
+    for k, v in kw.items(): setattr(j, k, v)
+    touch_jobs(j)
+
+def spill_log(j, lines):
+    try:
+        with open(pathlib.Path(j.cfg['tmpdir'])/'ffmpeg.log', 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+    except OSError:
+        pass
+
+def push_log(job_id, lines):
     j = JOBS[job_id]
-    if j.get('canceled'):
+    overflow = len(j.log) + len(lines) - LOG_MAX_LINES
+    if overflow > 0:
+        spill_log(j, (list(j.log) + lines)[:overflow])
+    j.log.extend(lines)
+    j.log_total += len(lines)
+    touch_jobs(j)
+
+def run_and_stream(cmd, job_id, hw_session=False, duration=None):
+    """Run one ffmpeg step once a render slot (and, for `hw_session`, a GPU encode session) is free.
+    `duration` is the length of what the step writes (default: the whole mix), for j.pct."""
+    j = JOBS[job_id]
+    if j.canceled:
+        return -1
+    job_update(j, step_target=duration or j.target, pct=0.0)
+    # Structured key=value progress instead of the \r stats line and banner; read the pipe in big chunks
+    cmd = cmd[:1] + ['-progress','pipe:1','-nostats','-loglevel','error'] + cmd[1:]
+    # The CPU slot is taken first so a job waiting on it never sits on a scarce encoder session
+    if not acquire_for_job(j, lambda t: acquire_ffmpeg(timeout=t), release_ffmpeg):
         return -1
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
-    j['proc'] = proc
-    for line in proc.stdout:
-        j['progress'] = line.strip()
-        push_log(job_id, line.rstrip('\n'))
-        if j.get('canceled'):
+    try:
+        if hw_session and not acquire_for_job(j, lambda t: ENCODER_SEM.acquire(timeout=t), ENCODER_SEM.release):
+            return -1
+        try:
+            return stream_ffmpeg(cmd, job_id)
+        finally:
+            if hw_session: ENCODER_SEM.release()
+    finally:
+        release_ffmpeg()
+
+def stream_ffmpeg(cmd, job_id):
+    j = JOBS[job_id]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    j.proc = proc
+    if j.canceled:  # /cancel ran before j.proc was set
+        proc.terminate()
+    kv = j.progress_kv = {}
+    fd = proc.stdout.fileno()
+    pending = b''
+    while True:
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            break
+        *lines, pending = (pending + chunk).split(b'\n')
+        out = []
+        for raw in lines:
+            raw = raw.rstrip(b'\r')
+            # -progress lines are 7-bit key=value pairs; only log lines need a UTF-8 decode
+            k, sep, v = raw.partition(b'=')
+            if sep and b' ' not in k:
+                k = k.decode('ascii', 'replace'); v = v.decode('ascii', 'replace')
+                kv[k] = v
+                if k == 'out_time': j.progress = f'out_time={v}'
+                elif k == 'out_time_us' and j.step_target:
+                    try: j.pct = min(1.0, int(v) / (j.step_target * 1_000_000))
+                    except ValueError: pass
+            elif raw.strip():
+                out.append(raw.decode('utf-8', 'replace'))
+        if out: push_log(job_id, out)
+        elif lines: touch_jobs(j)
+        if j.canceled:
             try: proc.terminate()
             except Exception: pass
             break
+    if pending.strip(): push_log(job_id, [pending.decode('utf-8', 'replace').strip()])
     rc = proc.wait()
-    j.pop('proc', None)
+    j.proc = None
     return rc
 
-def build_overlay_filter(logo_path, pos, scale_pct, opacity_pct, target_res):
+def build_crossfade_filter(n, crossfade, tail='anull'):
+    """filter_complex that crossfades inputs 0..n-1 into [aout], finishing with `tail`"""
+    fc_parts, labels = [], []
+    for i in range(n):
+        si = f's{i}'
+        fc_parts.append(f'[{i}:a]aformat=sample_fmts=fltp:sample_rates=44100:channel_layouts=stereo[{si}]')
+        labels.append(si)
+    # Pairwise (tournament) reduction keeps track order but halves graph depth,
+    # so independent acrossfade nodes can run on separate filter threads
+    level = labels; idx = 1
+    while len(level) > 1:
+        nxt = []
+        for a, b in zip(level[0::2], level[1::2]):
+            out = f'f{idx}'
+            fc_parts.append(f'[{a}][{b}]acrossfade=d={crossfade}:c1=tri:c2=tri[{out}]')
+            nxt.append(out); idx += 1
+        if len(level) % 2: nxt.append(level[-1])
+        level = nxt
+    fc_parts.append(f'[{level[0]}]{tail}[aout]')
+    return '; '.join(fc_parts)
+
+def build_overlay_filter(logo_path, pos, scale_pct, opacity_pct, target_res, vf_tail='', bg='0:v', logo='1:v'):
     try:
         W_target, H_target = target_res.split("x")
     except ValueError:
@@ -511,34 +1201,93 @@ def build_overlay_filter(logo_path, pos, scale_pct, opacity_pct, target_res):
     alpha = max(0.1, min(1.0, float(opacity_pct) / 100.0))
     # Make final scale part of the complex graph to avoid -vf conflicts
     return (
-        f"[1:v]format=rgba,scale=w={scale_expr}:h=-1,colorchannelmixer=aa={alpha}[l2];"
-        f"[0:v][l2]overlay=x={x_expr}:y={y_expr}:format=auto,scale={W_target}:{H_target},setsar=1[vout]"
+        f"[{logo}]format=rgba,scale=w={scale_expr}:h=-1,colorchannelmixer=aa={alpha}[l2];"
+        f"[{bg}][l2]overlay=x={x_expr}:y={y_expr}:format=auto,scale={W_target}:{H_target},setsar=1{vf_tail}[vout]"
     )
 
-def start_next_if_idle():
-    global RUNNING
-    if RUNNING is not None: return
-    if not QUEUE: return
-    job_id = QUEUE.popleft()
+def queue_push(job_id):
+    global QUEUE_POS
+    with QUEUE_LOCK:
+        QUEUE.append(job_id)
+        QUEUE_POS = {jid: i+1 for i, jid in enumerate(QUEUE)}
+    touch_jobs()
+
+def queue_drop(job_id):
+    global QUEUE_POS
+    with QUEUE_LOCK:
+        try: QUEUE.remove(job_id)
+        except ValueError: return
+        QUEUE_POS = {jid: i+1 for i, jid in enumerate(QUEUE)}
+    touch_jobs()
+
+def queue_pos(job_id):
+    return QUEUE_POS.get(job_id, 0 if job_id in RUNNING else None)
+
+def run_job(job_id):
+    queue_drop(job_id)
     j = JOBS.get(job_id)
-    if not j or j.get('canceled'):
-        start_next_if_idle(); return
-    RUNNING = job_id
-    j['stage'] = 'Starting...'
-    threading.Thread(target=build_job, args=(job_id,), daemon=True).start()
-
-def end_job(job_id):
-    global RUNNING
-    if RUNNING == job_id:
-        RUNNING = None
-    start_next_if_idle()
+    if not j: return
+    if j.canceled:
+        job_update(j, completed_at=time.time()); return
+    RUNNING.add(job_id)
+    job_update(j, stage='Starting...')
+    try:
+        build_job(job_id)
+    finally:
+        RUNNING.discard(job_id)
+        job_update(j, completed_at=time.time())
+
+# Finished jobs are dropped from JOBS after JOB_TTL; their download stays reachable through
+# OUTFILES for OUTFILE_TTL (the temp dir itself is only cleaned up after two days)
+JOB_TTL = int(os.environ.get('LOFI_JOB_TTL', 3600))
+OUTFILE_TTL = 86400
+OUTFILES = {}  # job id -> (output path, completed_at)
+
+def purge_jobs(ttl=JOB_TTL):
+    """Evict jobs finished more than `ttl` seconds ago; return how many went"""
+    now = time.time()
+    old = [jid for jid, j in JOBS.items() if j.completed_at is not None and now - j.completed_at >= ttl]
+    for jid in old:
+        registry_pop('JOBS', jid)
+    for jid, (_, done_at) in list(OUTFILES.items()):
+        if now - done_at > OUTFILE_TTL:
+            OUTFILES.pop(jid, None)
+    if old: touch_jobs()
+    return len(old)
+
+def job_sweeper():
+    while True:
+        time.sleep(60)
+        try:
+            purge_jobs()
+            if CACHE_MAX_BYTES: prune_cache()
+        except Exception: traceback.print_exc()
+
+threading.Thread(target=job_sweeper, daemon=True).start()
+
+def shutdown_renders():
+    """Drop queued jobs and stop running ffmpegs; otherwise exit joins EXEC's workers until every render ends"""
+    EXEC.shutdown(wait=False, cancel_futures=True)
+    for j in JOBS.values():
+        if j.completed_at is not None: continue
+        j.canceled = True  # also releases jobs still waiting for an ffmpeg slot
+        proc = j.proc
+        if proc:
+            try: proc.terminate()
+            except Exception: pass
+
+def job_outfile(job_id):
+    j = JOBS.get(job_id)
+    if j is not None:
+        return j.outfile
+    return OUTFILES.get(job_id, (None,))[0]
 
 def build_job(job_id):
     j = JOBS[job_id]
     try:
-        cfg = j['cfg']
-        crossfade = int(cfg['crossfade'])
-        target_minutes = int(cfg['target_minutes'])
+        cfg = j.cfg
+        crossfade = cfg['crossfade']
+        target_minutes = cfg['target_minutes']
         resolution = cfg['resolution']
         abitrate = cfg['abitrate']
         preset = cfg['preset']
@@ -549,128 +1298,161 @@ def build_job(job_id):
         img_path = cfg['img_path']
         vid_path = cfg['vid_path']
         logo_png = cfg.get('logo_png')
-        logo_pos = cfg.get('logo_pos','top-left')
-        logo_scale = int(cfg.get('logo_scale','18'))
-        logo_opacity = int(cfg.get('logo_opacity','80'))
-
-        # Step 1: build crossfaded playlist
-        j['stage'] = 'Step 1: Crossfading tracks...'
-        inputs = []
-        for p in song_paths:
-            inputs += ['-i', str(p)]
-        fc_parts, labels = [], []
-        for i in range(len(song_paths)):
-            si = f's{i}'
-            fc_parts.append(f'[{i}:a]aformat=sample_fmts=fltp:sample_rates=44100:channel_layouts=stereo[{si}]')
-            labels.append(si)
-        prev = labels[0]; idx = 1
-        for i in range(1, len(labels)):
-            curr = labels[i]; out = f'f{idx}'
-            fc_parts.append(f'[{prev}][{curr}]acrossfade=d={crossfade}:c1=tri:c2=tri[{out}]')
-            prev = out; idx += 1
-        final = 'aout'
-        fc_parts.append(f'[{prev}]anull[{final}]')
-        playlist_path = tmpdir/'playlist.mp3'
-        cmd_playlist = ['ffmpeg','-y'] + inputs + [
-            '-filter_complex','; '.join(fc_parts),
-            '-map',f'[{final}]','-ar','44100','-ac','2','-c:a','libmp3lame','-b:a',abitrate, str(playlist_path)
-        ]
-        rc = run_and_stream(cmd_playlist, job_id)
-        if rc != 0: raise RuntimeError('FFmpeg crossfade failed')
-        if j.get('canceled'): raise RuntimeError('Canceled')
-
-        # Step 2: loop playlist to target length
-        j['stage'] = 'Step 2: Looping playlist...'
-        out = subprocess.run(['ffprobe','-v','error','-show_entries','format=duration','-of','default=nw=1:nk=1', str(playlist_path)], capture_output=True, text=True)
-        try: playlist_sec = float(out.stdout.strip())
-        except Exception: playlist_sec = 0.0
-        if playlist_sec <= 0: raise RuntimeError('Could not measure playlist duration')
+        logo_pos = cfg['logo_pos']
+        logo_scale = cfg['logo_scale']
+        logo_opacity = cfg['logo_opacity']
+
+        # Each seam overlaps two tracks by `crossfade` seconds
+        durs = [get_dur(p) for p in song_paths]
+        playlist_sec = sum(durs) - (len(song_paths)-1)*crossfade
+        if min(durs) <= 0 or playlist_sec <= 0: raise RuntimeError('Could not measure playlist duration')
         target_sec = max(60, target_minutes * 60)
-        j['target'] = target_sec
-        loops = max(0, math.ceil(target_sec/playlist_sec) - 1)
-        long_path = tmpdir/'long_playlist.mp3'
-        if loops > 0:
-            rc = run_and_stream(['ffmpeg','-y','-stream_loop',str(loops),'-i',str(playlist_path),'-c','copy',str(long_path)], job_id)
-            if rc != 0: raise RuntimeError('FFmpeg audio loop failed')
-        else:
-            shutil.copyfile(playlist_path, long_path)
-        if j.get('canceled'): raise RuntimeError('Canceled')
-
-        # Step 3: render video
-        j['stage'] = 'Step 3: Rendering video...'
+        job_update(j, target=target_sec)
+
+        # Reuse an earlier render of the same songs, background, logo and settings
+        hashes = cfg.get('hashes') or {}
+        digest = lambda p: hashes.get(str(p)) or file_sha1(p)
+        song_hashes = [digest(p) for p in song_paths]
+        bg_hash = digest(vid_path if use_video_bg else img_path)
+        logo_hash = digest(logo_png) if logo_png else None
+        audio_key = cache_key(song_hashes, crossfade, abitrate)
+        render_key = cache_key(song_hashes, bg_hash, logo_hash, use_video_bg,
+                               {k: cfg.get(k) for k in ('crossfade','target_minutes','resolution','abitrate','preset',
+                                                        'logo_pos','logo_scale','logo_opacity')})
         out_path = tmpdir/f'{basename}.mp4'
-
-        if use_video_bg:
-            if logo_png:
-                filter_complex = build_overlay_filter(logo_png, logo_pos, logo_scale, logo_opacity, resolution)
-                cmd = [
-                    'ffmpeg','-y','-stream_loop','-1','-i',str(vid_path),
-                    '-i',str(logo_png),'-i',str(long_path),
-                    '-filter_complex', filter_complex,
-                    '-map','[vout]','-map','2:a',
-                    '-c:v','libx264','-preset',preset,
-                    '-c:a','aac','-b:a',abitrate,
-                    '-shortest','-pix_fmt','yuv420p',
-                    str(out_path)
-                ]
-            else:
-                cmd = [
-                    'ffmpeg','-y','-stream_loop','-1','-i',str(vid_path),
-                    '-i',str(long_path),
-                    '-c:v','libx264','-preset',preset,
-                    '-c:a','aac','-b:a',abitrate,
-                    '-shortest','-pix_fmt','yuv420p',
-                    '-vf', f'scale={resolution}',
-                    str(out_path)
-                ]
+        if cache_fetch(render_key, '.mp4', out_path):
+            job_update(j, stage='Reusing cached render...')
         else:
-            if logo_png:
-                filter_complex = build_overlay_filter(logo_png, logo_pos, logo_scale, logo_opacity, resolution)
-                cmd = [
-                    'ffmpeg','-y','-loop','1','-i',str(img_path),
-                    '-i',str(logo_png),'-i',str(long_path),
-                    '-filter_complex', filter_complex,
-                    '-map','[vout]','-map','2:a',
-                    '-c:v','libx264','-preset',preset,'-tune','stillimage',
-                    '-c:a','aac','-b:a',abitrate,
-                    '-shortest','-pix_fmt','yuv420p',
-                    str(out_path)
-                ]
+            song_in = []
+            for p in song_paths:
+                song_in += INPUT_QUEUE + ['-fflags', '+discardcorrupt', '-i', str(p)]
+            threads = ['-filter_threads','0','-filter_complex_threads','0']
+            length = ['-t',str(target_sec)]
+
+            # Crossfade straight into the render when the looped mix fits in memory
+            # (aloop keeps it as s16 PCM); otherwise go through playlist.mp3
+            needs_loop = playlist_sec < target_sec
+            # Hard cuts between uniform MP3s: join the frames as-is instead of decoding
+            copy_concat = crossfade == 0 and all(is_copyable_mp3(p) for p in song_paths)
+            fused = not copy_concat and (not needs_loop or playlist_sec * 44100 * 4 <= FUSE_MAX_BYTES)
+            if copy_concat:
+                job_update(j, stage='Step 1: Joining tracks...')
+                playlist_path = tmpdir/'playlist.mp3'
+                concat_path = tmpdir/'concat.txt'
+                concat_path.write_text(''.join("file '%s'\n" % str(p.resolve()).replace("'", "'\\''") for p in song_paths))
+                cmd_playlist = ['ffmpeg','-y','-f','concat','-safe','0','-i',str(concat_path),
+                                '-map','0:a','-c','copy', str(playlist_path)]
+                if not cache_fetch(audio_key, '.copy.mp3', playlist_path):
+                    rc = run_and_stream(cmd_playlist, job_id, duration=playlist_sec)
+                    if rc != 0: raise RuntimeError('FFmpeg concat failed')
+                    if j.canceled: raise RuntimeError('Canceled')
+                    cache_store(playlist_path, audio_key, '.copy.mp3')
+                audio_fc = None
+                audio_in = INPUT_QUEUE + ['-stream_loop','-1','-i',str(playlist_path)]; audio_map = '0:a'; base = 1
+            elif fused:
+                loop_samples = min(int((playlist_sec * 1.1 + 10) * 44100), 2**31 - 1)  # aloop stops at EOF anyway
+                tail = f'aformat=sample_fmts=s16,aloop=loop=-1:size={loop_samples}' if needs_loop else 'anull'
+                audio_fc = build_crossfade_filter(len(song_paths), crossfade, tail)
+                audio_in = song_in; audio_map = '[aout]'; base = len(song_paths)
             else:
-                cmd = [
-                    'ffmpeg','-y','-loop','1','-i',str(img_path),
-                    '-i',str(long_path),
-                    '-c:v','libx264','-preset',preset,'-tune','stillimage',
-                    '-c:a','aac','-b:a',abitrate,
-                    '-shortest','-pix_fmt','yuv420p',
-                    '-vf', f'scale={resolution}',
-                    str(out_path)
+                # Step 1: build crossfaded playlist
+                job_update(j, stage='Step 1: Crossfading tracks...')
+                playlist_path = tmpdir/'playlist.mp3'
+                cmd_playlist = ['ffmpeg','-y'] + threads + song_in + [
+                    '-filter_complex', build_crossfade_filter(len(song_paths), crossfade),'-threads','0',
+                    '-map','[aout]','-ar','44100','-ac','2','-c:a','libmp3lame','-b:a',abitrate, str(playlist_path)
                 ]
-
-        rc = run_and_stream(cmd, job_id)
-        if rc != 0: raise RuntimeError('FFmpeg video render failed')
-
-        j['stage'] = 'Done'
-        j['done'] = True
-        j['outfile'] = str(out_path)
+                if not cache_fetch(audio_key, '.mp3', playlist_path):
+                    rc = run_and_stream(cmd_playlist, job_id, duration=playlist_sec)
+                    if rc != 0: raise RuntimeError('FFmpeg crossfade failed')
+                    if j.canceled: raise RuntimeError('Canceled')
+                    cache_store(playlist_path, audio_key, '.mp3')
+                # the playlist is looped by the demuxer and cut to length in the render
+                audio_fc = None
+                audio_in = INPUT_QUEUE + ['-stream_loop','-1','-i',str(playlist_path)]; audio_map = '0:a'; base = 1
+
+            if use_video_bg:
+                # Scale (and overlay the logo on) one pass of the background video,
+                # then stream-copy that clip in a loop for the whole mix
+                job_update(j, stage='Preparing background...')
+                pre, vcodec, vf_tail = encoder_args(HW_ENCODER, preset)
+                loop_path = tmpdir/'loop_bg.mp4'
+                vid_in = ['-i',str(vid_path)]
+                if logo_png:
+                    vid_in += ['-i',str(logo_png)]
+                    vf = ['-filter_complex', build_overlay_filter(logo_png, logo_pos, logo_scale, logo_opacity, resolution, vf_tail),
+                          '-map','[vout]']
+                else:
+                    vf = ['-vf', f'scale={resolution},setsar=1{vf_tail}']
+                # No B-frames and a keyframe on the first frame, like the still clip: every pass of the
+                # copied loop then starts cleanly on an IDR with no reordering delay across the seam
+                seam = ['-bf','0','-force_key_frames','0']
+                cmd_loop = ['ffmpeg','-y'] + threads + pre + vid_in + vf + vcodec + seam + ['-an'] + length + [str(loop_path)]
+                rc = run_and_stream(cmd_loop, job_id, hw_session=HW_ENCODER != 'libx264',
+                                    duration=min(target_sec, get_dur(vid_path) or target_sec))
+                if rc != 0: raise RuntimeError('FFmpeg background render failed')
+                if j.canceled: raise RuntimeError('Canceled')
+                pre, vcodec = [], ['-c:v','copy']
+                bg_in = INPUT_QUEUE + ['-stream_loop','-1','-i',str(loop_path)]
+                video_fc = None; video_map = f'{base}:v'
+            else:
+                # A still image only needs encoding once: render a single-GOP clip
+                # (one IDR + skip frames) and stream-copy it in a loop for the whole mix
+                job_update(j, stage='Preparing background...')
+                still_path = tmpdir/'still.mp4'
+                still = ['-t',str(STILL_CLIP_SEC),'-c:v','libx264','-preset',STILL_PRESET,'-tune','stillimage',
+                         '-g',str(STILL_FPS*STILL_CLIP_SEC),'-bf','0','-pix_fmt','yuv420p', str(still_path)]
+                img_in = INPUT_QUEUE + ['-loop','1','-framerate',str(STILL_FPS),'-i',str(img_path)]
+                if logo_png:
+                    filter_complex = build_overlay_filter(logo_png, logo_pos, logo_scale, logo_opacity, resolution)
+                    cmd_still = ['ffmpeg','-y'] + img_in + ['-i',str(logo_png),
+                        '-filter_complex', filter_complex, '-map','[vout]'] + still
+                else:
+                    cmd_still = ['ffmpeg','-y'] + img_in + ['-vf', f'scale={resolution},setsar=1'] + still
+                rc = run_and_stream(cmd_still, job_id, duration=STILL_CLIP_SEC)
+                if rc != 0: raise RuntimeError('FFmpeg background render failed')
+                if j.canceled: raise RuntimeError('Canceled')
+                pre, vcodec = [], ['-c:v','copy']
+                bg_in = INPUT_QUEUE + ['-stream_loop','-1','-i',str(still_path)]
+                video_fc = None; video_map = f'{base}:v'
+
+            job_update(j, stage='Rendering video...' if fused else 'Step 2: Rendering video...')
+            filter_complex = '; '.join(f for f in (audio_fc, video_fc) if f)
+            # moov up front so the file plays while downloading; fragments for very long renders
+            movflags = ['-movflags', '+frag_keyframe+empty_moov' if target_minutes > FRAG_MIN_MINUTES else '+faststart']
+            cmd = ['ffmpeg','-y'] + threads + pre + audio_in + bg_in + (
+                ['-filter_complex', filter_complex] if filter_complex else []) + [
+                '-map',video_map,'-map',audio_map] + vcodec + [
+                '-c:a','aac','-b:a',abitrate,'-threads','0',
+                '-shortest'] + length + movflags + [
+                str(out_path)
+            ]
+
+            rc = run_and_stream(cmd, job_id)
+            if rc != 0: raise RuntimeError('FFmpeg video render failed')
+            cache_store(out_path, render_key, '.mp4')
+
+        job_update(j, stage='Done', done=True, outfile=str(out_path))
+        OUTFILES[job_id] = (str(out_path), time.time())
 
         # Add to available videos for streaming
-        VIDEOS[job_id] = {
+        registry_put('VIDEOS', job_id, {
             'path': str(out_path),
             'name': pathlib.Path(out_path).name,
             'size': pathlib.Path(out_path).stat().st_size if pathlib.Path(out_path).exists() else 0,
             'type': 'rendered',
-            'created_at': time.time()
-        }
+            'created_at': time.time(),
+            'verified_at': time.time()
+        })
     except Exception as e:
-        j['done'] = True
-        j['error'] = str(e)
-    finally:
-        end_job(job_id)
+        job_update(j, done=True, error=str(e))
 
 @app.route('/', methods=['GET'])
 def index():
-    resp = make_response(render_template_string(HTML))
+    body = _INDEX_PAGES.get(request.script_root)
+    if body is None:
+        body = _INDEX_PAGES[request.script_root] = HTML_TEMPLATE.render()
+    resp = make_response(body)
     resp.headers["Cache-Control"] = "no-store"
     return resp
 
@@ -679,6 +1461,20 @@ def static_files(filename):
     return send_from_directory('static', filename)
 
 # ---------- MISSING ROUTES (now added) ----------
+# Render settings taken from the form, with their defaults; FORM_INTS are converted once here
+FORM_DEFAULTS = types.MappingProxyType({
+    'crossfade': '5',
+    'target_minutes': '180',
+    'resolution': '1920x1080',
+    'abitrate': '192k',
+    'preset': 'ultrafast',
+    'basename': 'lofi_mix',
+    'logo_pos': 'top-left',
+    'logo_scale': '18',
+    'logo_opacity': '80'
+})
+FORM_INTS = ('crossfade', 'target_minutes', 'logo_scale', 'logo_opacity')
+
 @app.route('/enqueue', methods=['POST'])
 def enqueue_job():
     job_id = uuid.uuid4().hex
@@ -689,14 +1485,14 @@ def enqueue_job():
         shutil.rmtree(tmpdir, ignore_errors=True)
         return redirect(url_for('index'))
 
-    song_paths = []
+    song_paths = []; uploads = []
     for i, f in enumerate(songs):
         ext = pathlib.Path(f.filename).suffix.lower()
         if ext not in ['.mp3','.m4a','.wav']:
             shutil.rmtree(tmpdir, ignore_errors=True)
             return redirect(url_for('index'))
         p = tmpdir / f"song{i+1}{ext}"
-        f.save(p)
+        uploads.append((f, p))
         song_paths.append(str(p))
 
     img_path = None; vid_path = None; use_video_bg = False
@@ -704,12 +1500,12 @@ def enqueue_job():
         v = request.files['video_bg']
         if pathlib.Path(v.filename).suffix.lower() != '.mp4':
             shutil.rmtree(tmpdir, ignore_errors=True); return redirect(url_for('index'))
-        vid_path = str(tmpdir/'loop.mp4'); v.save(vid_path); use_video_bg = True
+        vid_path = str(tmpdir/'loop.mp4'); uploads.append((v, vid_path)); use_video_bg = True
     elif 'image_bg' in request.files and request.files['image_bg'].filename:
         img = request.files['image_bg']; ext = pathlib.Path(img.filename).suffix.lower()
         if ext not in ['.png','.jpg','.jpeg']:
             shutil.rmtree(tmpdir, ignore_errors=True); return redirect(url_for('index'))
-        ip = tmpdir/f"image{ext}"; img.save(ip); img_path = str(ip)
+        ip = tmpdir/f"image{ext}"; uploads.append((img, ip)); img_path = str(ip)
     else:
         shutil.rmtree(tmpdir, ignore_errors=True); return redirect(url_for('index'))
 
@@ -718,71 +1514,118 @@ def enqueue_job():
         lg = request.files['logo_png']
         if pathlib.Path(lg.filename).suffix.lower() != '.png':
             shutil.rmtree(tmpdir, ignore_errors=True); return redirect(url_for('index'))
-        lp = tmpdir/'logo.png'; lg.save(lp); logo_png = str(lp)
-
-    cfg = {
-        'crossfade': request.form.get('crossfade','5'),
-        'target_minutes': request.form.get('target_minutes','180'),
-        'resolution': request.form.get('resolution','1920x1080'),
-        'abitrate': request.form.get('abitrate','192k'),
-        'preset': request.form.get('preset','ultrafast'),
-        'basename': (request.form.get('basename','lofi_mix') or 'lofi_mix').strip(),
+        lp = tmpdir/'logo.png'; uploads.append((lg, lp)); logo_png = str(lp)
+
+    form = request.form
+    cfg = {k: form.get(k) or v for k, v in FORM_DEFAULTS.items()}
+    try:
+        for k in FORM_INTS: cfg[k] = int(cfg[k])
+    except ValueError:
+        shutil.rmtree(tmpdir, ignore_errors=True); return redirect(url_for('index'))
+    # Used as the output file name inside tmpdir, so reduce it to a bare name (no '../' or separators)
+    cfg['basename'] = secure_filename(cfg['basename'].strip()) or FORM_DEFAULTS['basename']
+
+    hashes = save_uploads(uploads, hash_paths={str(p) for p in song_paths + [vid_path, img_path, logo_png] if p})
+
+    cfg.update({
         'tmpdir': str(tmpdir),
         'songs': song_paths,
         'use_video_bg': use_video_bg,
         'img_path': img_path,
         'vid_path': vid_path,
         'logo_png': logo_png,
-        'logo_pos': request.form.get('logo_pos','top-left'),
-        'logo_scale': request.form.get('logo_scale','18'),
-        'logo_opacity': request.form.get('logo_opacity','80')
-    }
+        'hashes': hashes
+    })
 
-    JOBS[job_id] = {'id':job_id,'stage':'Queued...','progress':'','log':[],'done':False,'error':None,'outfile':None,'target':None,'canceled':False,'cfg':cfg}
-    QUEUE.append(job_id); start_next_if_idle()
+    registry_put('JOBS', job_id, Job(job_id, cfg))
+    queue_push(job_id); EXEC.submit(run_job, job_id)
     return redirect(url_for('index', **{'job': job_id}))
 
+LONG_POLL_MAX = 25  # seconds a ?wait= request may block for a change
+
+def poll_wait(etag_fn):
+    """Block (up to ?wait= seconds) while the client's If-None-Match still matches; return the current ETag"""
+    etag = etag_fn()
+    wait = min(request.args.get('wait', 0, type=float), LONG_POLL_MAX)
+    if wait > 0 and etag in request.if_none_match:
+        with JOBS_CHANGED:
+            JOBS_CHANGED.wait_for(lambda: etag_fn() != etag, timeout=wait)
+        etag = etag_fn()
+    return etag
+
+def etag_response(payload, etag):
+    resp = jsonify(payload)
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'  # always revalidate, so unchanged polls get a 304
+    return resp
+
 @app.route('/status/<job_id>', methods=['GET'])
 def status(job_id):
     j = JOBS.get(job_id)
     if not j: return jsonify({'error':'not found'}),404
-    try: qpos = list(QUEUE).index(job_id) + 1
-    except ValueError: qpos = 0 if RUNNING == job_id else None
-    return jsonify({
-        'stage': j.get('stage',''),
-        'progress': j.get('progress',''),
-        'done': j.get('done',False),
-        'error': j.get('error'),
-        'outfile': True if j.get('outfile') else False,
-        'target': j.get('target'),
-        'canceled': j.get('canceled',False),
-        'log': j.get('log',[]),
+    # queue position moves with other jobs, so it is part of the tag
+    etag = poll_wait(lambda: f"{j.version}.{queue_pos(job_id)}")
+    if etag in request.if_none_match:
+        return '', 304, {'ETag': f'"{etag}"'}
+    qpos = queue_pos(job_id)
+    log = list(j.log)
+    since = request.args.get('since', type=int)
+    if since is not None:
+        log = log[max(0, len(log) - (j.log_total - since)):] if since < j.log_total else []
+        if since >= j.log_total and j.completed_at is not None and j.log:
+            # A finished job's client has read every line: move the rest to ffmpeg.log and free it
+            spill_log(j, list(j.log)); j.log.clear()
+    return etag_response({
+        'stage': j.stage,
+        'progress': j.progress,
+        'done': j.done,
+        'error': j.error,
+        'outfile': True if j.outfile else False,
+        'target': j.target,
+        'step_target': j.step_target,
+        'pct': j.pct,
+        'canceled': j.canceled,
+        'log': log,
+        'log_offset': j.log_total - len(log),  # index of log[0]; pass log_total back as ?since=
+        'log_total': j.log_total,
         'queue_pos': qpos
-    })
+    }, etag)
 
 @app.route('/jobs', methods=['GET'])
 def jobs():
+    etag = poll_wait(lambda: f"{BOOT_ID}.{JOBS_VERSION}")
+    if etag in request.if_none_match:
+        return '', 304, {'ETag': f'"{etag}"'}
+    # One consistent snapshot of the queue for the whole listing
+    pos, running = QUEUE_POS, set(RUNNING)
     rows = []
     for jid, j in JOBS.items():
-        try: qpos = list(QUEUE).index(jid) + 1
-        except ValueError: qpos = 0 if RUNNING == jid else None
-        rows.append({'id':jid,'stage':j.get('stage',''),'progress':j.get('progress',''),'done':j.get('done',False),'error':j.get('error'),'outfile':True if j.get('outfile') else False,'queue_pos':qpos})
+        qpos = pos.get(jid, 0 if jid in running else None)
+        rows.append({'id':jid,'stage':j.stage,'progress':j.progress,'done':j.done,'error':j.error,'outfile':True if j.outfile else False,'queue_pos':qpos})
     def keyfun(r):
-        if RUNNING == r['id']: return (0,0)
+        if r['id'] in running: return (0,0)
         if r['queue_pos']: return (1,r['queue_pos'])
         return (2,0)
     rows.sort(key=keyfun)
-    return jsonify(rows)
+    resp = etag_response(rows, etag)
+    resp.headers['X-FFmpeg-Active'] = str(FFMPEG_ACTIVE['render'])
+    resp.headers['X-FFmpeg-Max'] = str(MAX_FFMPEG)
+    resp.headers['X-Streams-Active'] = str(FFMPEG_ACTIVE['stream'])
+    resp.headers['X-Streams-Max'] = str(MAX_STREAMS)
+    return resp
+
+@app.route('/jobs/purge', methods=['POST'])
+def jobs_purge():
+    return jsonify({'purged': purge_jobs(ttl=0)})
 
 @app.route('/cancel/<job_id>', methods=['POST'])
 def cancel(job_id):
     j = JOBS.get(job_id)
     if not j: return 'not found',404
-    j['canceled'] = True
-    try: QUEUE.remove(job_id)
-    except ValueError: pass
-    if RUNNING == job_id:
-        proc = j.get('proc')
+    job_update(j, canceled=True)
+    queue_drop(job_id)
+    if job_id in RUNNING:
+        proc = j.proc
         if proc:
             try: proc.terminate()
             except Exception: pass
@@ -790,9 +1633,18 @@ def cancel(job_id):
 
 @app.route('/download/<job_id>', methods=['GET'])
 def download(job_id):
-    j = JOBS.get(job_id)
-    if not j or not j.get('outfile'): return 'Not ready',404
-    return send_file(j['outfile'], as_attachment=True, download_name=pathlib.Path(j['outfile']).name)
+    outfile = job_outfile(job_id)
+    if not outfile: return 'Not ready',404
+    name = pathlib.Path(outfile).name
+    if X_ACCEL_PREFIX:
+        rel = pathlib.Path(outfile).relative_to(TMP_BASE).as_posix()
+        resp = make_response('')
+        resp.headers['X-Accel-Redirect'] = f"{X_ACCEL_PREFIX.rstrip('/')}/{rel}"
+        resp.headers['Content-Type'] = 'video/mp4'
+        resp.headers.set('Content-Disposition', 'attachment', filename=name)
+        return resp
+    # Range/conditional support lets players seek and resume without re-sending the file
+    return send_file(outfile, as_attachment=True, download_name=name, conditional=True, etag=True)
 
 # ===== YouTube Streaming Routes =====
 @app.route('/youtube/auth', methods=['GET'])
@@ -833,17 +1685,16 @@ def youtube_callback():
     flow.fetch_token(authorization_response=request.url)
     creds = flow.credentials
 
-    session['youtube_credentials'] = {
-        'token': creds.token,
-        'refresh_token': creds.refresh_token,
-        'token_uri': creds.token_uri,
-        'client_id': creds.client_id,
-        'client_secret': creds.client_secret,
-        'scopes': creds.scopes
-    }
+    save_youtube_credentials(creds)
 
     return redirect(url_for('index') + '?youtube_auth=success')
 
+@app.route('/youtube/disconnect', methods=['POST'])
+def youtube_disconnect():
+    """Forget the connected YouTube account"""
+    clear_youtube_credentials()
+    return jsonify({'success': True})
+
 @app.route('/youtube/status', methods=['GET'])
 def youtube_status():
     """Check if YouTube is authenticated"""
@@ -853,141 +1704,93 @@ def youtube_status():
         'authenticated': creds is not None
     })
 
-@app.route('/youtube/stream/start', methods=['POST'])
-def create_stream_new():
-    """Create a YouTube broadcast and start streaming (new endpoint for video_id)"""
+def require_youtube():
+    """(credentials, None) when YouTube is configured and authenticated, else (None, error response)"""
     if not YOUTUBE_ENABLED:
-        return jsonify({'error': 'YouTube integration not configured'}), 400
-
+        return None, (jsonify({'error': 'YouTube integration not configured'}), 400)
     creds = get_youtube_credentials()
     if not creds:
-        return jsonify({'error': 'Not authenticated. Please authenticate first.'}), 401
-
-    data = request.get_json() or {}
-    video_id = data.get('video_id')
+        return None, (jsonify({'error': 'Not authenticated. Please authenticate first.'}), 401)
+    return creds, None
 
-    if not video_id or video_id not in VIDEOS:
-        return jsonify({'error': 'Video not found'}), 404
-
-    video_info = VIDEOS[video_id]
-    video_path = video_info['path']
-
-    if not pathlib.Path(video_path).exists():
-        return jsonify({'error': 'Video file not found'}), 404
-
-    if video_id in STREAMS and STREAMS[video_id].get('status') == 'streaming':
-        return jsonify({'error': 'Stream already active for this video'}), 400
-
-    # Get stream parameters
+def start_broadcast(creds, data, source_path, key, meta=None, extra=None):
+    """Create a broadcast for `source_path`, record it in STREAMS[key] and start streaming"""
     title = data.get('title', f"Lofi Mix - {time.strftime('%Y-%m-%d %H:%M')}")
     description = data.get('description', 'Lofi music mix created with Lofi Mixer Studio')
     privacy = data.get('privacy', 'unlisted')
 
-    # Create YouTube broadcast
     broadcast_info = create_youtube_broadcast(creds, title, description, privacy)
     if not broadcast_info:
         return jsonify({'error': 'Failed to create YouTube broadcast'}), 500
 
-    # Store stream info
-    STREAMS[video_id] = {
+    registry_put('STREAMS', key, {
         'broadcast_id': broadcast_info['broadcast_id'],
         'stream_id': broadcast_info['stream_id'],
         'watch_url': broadcast_info['watch_url'],
         'status': 'starting',
         'started_at': time.time(),
-        'video_name': video_info['name']
-    }
+        **(meta or {})
+    })
 
     # Start streaming in background
-    success = start_youtube_stream(
-        video_path,
-        broadcast_info['rtmp_url'],
-        broadcast_info['stream_key'],
-        video_id
-    )
-
-    if not success:
-        STREAMS.pop(video_id, None)
+    if not start_youtube_stream(source_path, broadcast_info['rtmp_url'], broadcast_info['stream_key'], key):
+        registry_pop('STREAMS', key)
         return jsonify({'error': 'Failed to start stream'}), 500
 
     return jsonify({
         'success': True,
         'watch_url': broadcast_info['watch_url'],
         'broadcast_id': broadcast_info['broadcast_id'],
-        'video_id': video_id
+        **(extra or {})
     })
 
+@app.route('/youtube/stream/start', methods=['POST'])
+def create_stream_new():
+    """Create a YouTube broadcast and start streaming (new endpoint for video_id)"""
+    creds, err = require_youtube()
+    if err: return err
+
+    data = request.get_json() or {}
+    video_id = data.get('video_id')
+    video_info = VIDEOS.get(video_id) if video_id else None
+    if not video_info:
+        return jsonify({'error': 'Video not found'}), 404
+    if not pathlib.Path(video_info['path']).exists():
+        return jsonify({'error': 'Video file not found'}), 404
+    if STREAMS.get(video_id, {}).get('status') == 'streaming':
+        return jsonify({'error': 'Stream already active for this video'}), 400
+
+    return start_broadcast(creds, data, video_info['path'], video_id,
+                           meta={'video_name': video_info['name']}, extra={'video_id': video_id})
+
 @app.route('/youtube/stream/<job_id>', methods=['POST'])
 def create_stream(job_id):
     """Create a YouTube broadcast and start streaming (legacy endpoint for job_id)"""
-    if not YOUTUBE_ENABLED:
-        return jsonify({'error': 'YouTube integration not configured'}), 400
-
-    creds = get_youtube_credentials()
-    if not creds:
-        return jsonify({'error': 'Not authenticated. Please authenticate first.'}), 401
+    creds, err = require_youtube()
+    if err: return err
 
-    j = JOBS.get(job_id)
-    if not j or not j.get('outfile'):
+    outfile = job_outfile(job_id)
+    if not outfile:
         return jsonify({'error': 'Video not ready'}), 404
-
-    if job_id in STREAMS and STREAMS[job_id].get('status') == 'streaming':
+    if STREAMS.get(job_id, {}).get('status') == 'streaming':
         return jsonify({'error': 'Stream already active'}), 400
 
-    # Get stream parameters
-    data = request.get_json() or {}
-    title = data.get('title', f"Lofi Mix - {time.strftime('%Y-%m-%d %H:%M')}")
-    description = data.get('description', 'Lofi music mix created with Lofi Mixer Studio')
-    privacy = data.get('privacy', 'unlisted')
-
-    # Create YouTube broadcast
-    broadcast_info = create_youtube_broadcast(creds, title, description, privacy)
-    if not broadcast_info:
-        return jsonify({'error': 'Failed to create YouTube broadcast'}), 500
-
-    # Store stream info
-    STREAMS[job_id] = {
-        'broadcast_id': broadcast_info['broadcast_id'],
-        'stream_id': broadcast_info['stream_id'],
-        'watch_url': broadcast_info['watch_url'],
-        'status': 'starting',
-        'started_at': time.time()
-    }
-
-    # Start streaming in background
-    success = start_youtube_stream(
-        j['outfile'],
-        broadcast_info['rtmp_url'],
-        broadcast_info['stream_key'],
-        job_id
-    )
-
-    if not success:
-        STREAMS.pop(job_id, None)
-        return jsonify({'error': 'Failed to start stream'}), 500
-
-    return jsonify({
-        'success': True,
-        'watch_url': broadcast_info['watch_url'],
-        'broadcast_id': broadcast_info['broadcast_id']
-    })
+    return start_broadcast(creds, request.get_json() or {}, outfile, job_id)
 
 @app.route('/youtube/stream/<job_id>/stop', methods=['POST'])
 def stop_stream(job_id):
     """Stop an active YouTube stream"""
-    if job_id not in STREAMS:
+    if not stop_youtube_stream(job_id):
         return jsonify({'error': 'No active stream'}), 404
-
-    success = stop_youtube_stream(job_id)
-    return jsonify({'success': success})
+    return jsonify({'success': True})
 
 @app.route('/youtube/stream/<job_id>/status', methods=['GET'])
 def stream_status(job_id):
     """Get stream status"""
-    if job_id not in STREAMS:
+    stream_info = STREAMS.get(job_id)
+    if stream_info is None:
         return jsonify({'active': False})
 
-    stream_info = STREAMS[job_id]
     return jsonify({
         'active': True,
         'status': stream_info.get('status'),
@@ -1013,21 +1816,38 @@ def upload_video():
     uploads_dir = pathlib.Path('uploads')
     uploads_dir.mkdir(exist_ok=True)
 
-    # Generate unique ID and save file
+    # The catalog keeps the original name, so the file is just named by its id
     video_id = uuid.uuid4().hex
-    filename = f"{video_id}_{video_file.filename}"
-    filepath = uploads_dir / filename
-
-    video_file.save(str(filepath))
+    filepath = uploads_dir / f"{video_id}.mp4"
+
+    # Count and hash while copying instead of stat-ing afterwards
+    size, h = 0, hashlib.sha1()
+    with open(filepath, 'wb') as dst:
+        for chunk in iter(lambda: video_file.stream.read(UPLOAD_CHUNK), b''):
+            dst.write(chunk); size += len(chunk); h.update(chunk)
+    digest = h.hexdigest()
+
+    # Same bytes already uploaded: share the existing file's blocks via a hard link
+    for other in VIDEOS.values():
+        if other.get('sha1') == digest and other['path'] != str(filepath):
+            try:
+                tmp = filepath.with_suffix('.link')
+                os.link(other['path'], tmp)
+                os.replace(tmp, filepath)
+            except OSError:
+                pass
+            break
 
     # Add to videos catalog
-    VIDEOS[video_id] = {
+    registry_put('VIDEOS', video_id, {
         'path': str(filepath),
         'name': video_file.filename,
-        'size': filepath.stat().st_size,
+        'size': size,
+        'sha1': digest,
         'type': 'uploaded',
-        'created_at': time.time()
-    }
+        'created_at': time.time(),
+        'verified_at': time.time()
+    })
 
     return jsonify({
         'success': True,
@@ -1035,20 +1855,29 @@ def upload_video():
         'name': video_file.filename
     })
 
+VIDEO_STAT_TTL = 60  # seconds a video's cached size/existence is trusted
+
 @app.route('/videos/list', methods=['GET'])
 def list_videos():
     """List all available videos for streaming"""
     videos_list = []
+    now = time.time()
     for vid_id, vid_info in VIDEOS.items():
-        # Check if file still exists
-        if pathlib.Path(vid_info['path']).exists():
-            videos_list.append({
-                'id': vid_id,
-                'name': vid_info['name'],
-                'size': vid_info['size'],
-                'type': vid_info['type'],
-                'created_at': vid_info['created_at']
-            })
+        # Re-check the file only every VIDEO_STAT_TTL seconds; drop entries whose file is gone
+        if now - vid_info.get('verified_at', 0) > VIDEO_STAT_TTL:
+            try:
+                vid_info['size'] = os.stat(vid_info['path']).st_size
+                vid_info['verified_at'] = now
+            except OSError:
+                registry_pop('VIDEOS', vid_id)
+                continue
+        videos_list.append({
+            'id': vid_id,
+            'name': vid_info['name'],
+            'size': vid_info['size'],
+            'type': vid_info['type'],
+            'created_at': vid_info['created_at']
+        })
 
     # Sort by creation time, newest first
     videos_list.sort(key=lambda x: x['created_at'], reverse=True)
@@ -1057,16 +1886,15 @@ def list_videos():
 @app.route('/videos/<video_id>', methods=['DELETE'])
 def delete_video(video_id):
     """Delete an uploaded video"""
-    if video_id not in VIDEOS:
+    video_info = VIDEOS.get(video_id)
+    if video_info is None:
         return jsonify({'error': 'Video not found'}), 404
 
-    video_info = VIDEOS[video_id]
-
     # Only allow deleting uploaded videos, not rendered ones
     if video_info['type'] == 'uploaded':
         try:
             pathlib.Path(video_info['path']).unlink(missing_ok=True)
-            del VIDEOS[video_id]
+            registry_pop('VIDEOS', video_id)
             return jsonify({'success': True})
         except Exception as e:
             return jsonify({'error': str(e)}), 500
@@ -1075,4 +1903,7 @@ def delete_video(video_id):
 
 # ----------------- server -----------------
 if __name__ == '__main__':
-    app.run(debug=True, host='127.0.0.1', port=5050)
+    try:
+        app.run(debug=True, host='127.0.0.1', port=5050, threaded=True)
+    finally:
+        shutdown_renders()
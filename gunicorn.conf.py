@@ -0,0 +1,18 @@
+# Production server config: gunicorn -c gunicorn.conf.py app:app
+import os
+
+bind = os.environ.get('LOFI_BIND', '127.0.0.1:5050')
+# Jobs, streams and the render queue live in process memory, so there must be exactly one worker
+workers = 1
+# Threads instead of gevent: renders read ffmpeg pipes with blocking os.read and wait on
+# threading primitives, which gevent's monkey-patching can't make cooperative. Each
+# long-polling /status or /jobs request parks one of these threads for up to 25 s.
+worker_class = 'gthread'
+threads = int(os.environ.get('LOFI_HTTP_THREADS', 64))
+# No `timeout`: with gthread it only checks that the worker process is alive, not how long a
+# request (e.g. a slow 2 GB upload) takes, so the 30 s default is fine
+
+def worker_exit(server, worker):
+    # Runs in the worker before it exits: stop renders instead of waiting for them to finish
+    from app import shutdown_renders
+    shutdown_renders()
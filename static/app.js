@@ -2,6 +2,10 @@
 
 let currentJobId = null;
 let pollInterval = null;
+// Log lines shown for the polled job; later polls only fetch lines after logTotal (?since=)
+let logJobId = null;
+let logLines = [];
+let logTotal = null;
 let streamPollInterval = null;
 let youtubeEnabled = false;
 let youtubeAuthenticated = false;
@@ -136,9 +140,16 @@ function startPolling() {
 }
 
 function updateProgress(jobId) {
-    fetch(`/status/${jobId}`)
+    if (jobId !== logJobId) {
+        logJobId = jobId;
+        logLines = [];
+        logTotal = null;
+    }
+    const since = logTotal != null ? `?since=${logTotal}` : '';
+    fetch(`/status/${jobId}${since}`)
         .then(res => res.json())
         .then(data => {
+            if (jobId !== logJobId) return;  // a newer job took over while this poll was in flight
             const stageEl = document.getElementById('stage');
             const barEl = document.getElementById('bar');
             const logBox = document.getElementById('logBox');
@@ -160,19 +171,22 @@ function updateProgress(jobId) {
             }
 
             // Calculate progress and ETA
-            if (data.target && data.progress) {
+            // pct and out_time are relative to the current ffmpeg step, not the whole mix
+            const stepTarget = data.step_target || data.target;
+            if (stepTarget && data.progress) {
                 const match = data.progress.match(/time=(\d+):(\d+):(\d+)/);
                 if (match) {
                     const hours = parseInt(match[1]);
                     const minutes = parseInt(match[2]);
                     const seconds = parseInt(match[3]);
-                    const currentTime = hours * 3600 + minutes * 60 + seconds;
-                    const percent = Math.min(100, (currentTime / data.target) * 100);
+                    const currentTime = data.pct != null ? Math.round(data.pct * stepTarget)
+                        : hours * 3600 + minutes * 60 + seconds;
+                    const percent = Math.min(100, (currentTime / stepTarget) * 100);
 
                     if (barEl) barEl.style.width = percent + '%';
 
                     if (percent > 0 && percent < 100) {
-                        const remaining = data.target - currentTime;
+                        const remaining = stepTarget - currentTime;
                         const mins = Math.floor(remaining / 60);
                         const secs = remaining % 60;
                         if (etaEl) etaEl.textContent = `~${mins}m ${secs}s`;
@@ -181,8 +195,14 @@ function updateProgress(jobId) {
             }
 
             // Update log
+            if (data.log) {
+                // Overlapping polls can return the same lines; skip any before logTotal
+                const skip = logTotal != null ? Math.max(0, logTotal - data.log_offset) : 0;
+                logLines = logLines.concat(data.log.slice(skip)).slice(-20);
+                logTotal = Math.max(logTotal || 0, data.log_total);
+            }
             if (logBox && data.log) {
-                const lastLines = data.log.slice(-20).join('\n');
+                const lastLines = logLines.join('\n');
                 logBox.textContent = lastLines || 'Waiting...';
                 logBox.scrollTop = logBox.scrollHeight;
             }